@@ -4,6 +4,13 @@ workers = int(os.environ.get("GUNICORN_PROCESSES", "2"))
 
 threads = int(os.environ.get("GUNICORN_THREADS", "4"))
 
+# Each worker starts its own polars thread pool, sized to every core by default.
+# Share the cores between the workers instead. Polars reads this when it is first
+# imported, which happens in the workers after this config is loaded.
+os.environ.setdefault(
+    "POLARS_MAX_THREADS", str(max(1, (os.cpu_count() or 1) // workers))
+)
+
 bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
 
 forwarded_allow_ips = "*"
@@ -1,4 +1,8 @@
 from dataclasses import dataclass
+from functools import lru_cache
+
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobServiceClient
 
 
 @dataclass
@@ -10,3 +14,32 @@ class AzureStorage:
     AZURE_STORAGE_ACCOUNT_URL: str = "https://cfaazurebatchprd.blob.core.windows.net/"
     AZURE_CONTAINER_NAME: str = "rt-epinow2-config"
     SCOPE_URL: str = "https://cfaazurebatchprd.blob.core.windows.net/.default"
+
+
+@lru_cache(maxsize=1)
+def get_credential() -> DefaultAzureCredential:
+    """
+    The credential shared by every blob service client in the process.
+    DefaultAzureCredential probes several auth methods the first time it is used and
+    caches its tokens per instance, so only pay for that once.
+    """
+    return DefaultAzureCredential()
+
+
+@lru_cache(maxsize=4)
+def get_blob_service_client(
+    account_url: str = AzureStorage.AZURE_STORAGE_ACCOUNT_URL,
+) -> BlobServiceClient:
+    """
+    The blob service client for a storage account, shared for the life of the process
+    so that connections and tokens are reused between downloads and uploads.
+    """
+    return BlobServiceClient(
+        account_url,
+        credential=get_credential(),
+        connection_timeout=20,
+        read_timeout=120,
+        # Fetch up to 64MB in the first GET of a download, so most of our parquet files
+        # come down in a single round trip
+        max_single_get_size=64 * 1024 * 1024,
+    )
@@ -1,13 +1,13 @@
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta, timezone
-from io import BytesIO
 from pathlib import Path
-from shutil import rmtree
+from shutil import copyfile, move, rmtree
+from tempfile import TemporaryDirectory
 
 import duckdb
 import polars as pl
 import quarto
-from azure.identity import DefaultAzureCredential
 from azure.storage.blob import (
     BlobProperties,
     BlobServiceClient,
@@ -17,7 +17,7 @@ from azure.storage.blob import (
 from rich.console import Console
 from rich.progress import track
 
-from src.cfa_rt_postprocessing.azure_constants import AzureStorage
+from src.cfa_rt_postprocessing.azure_constants import get_blob_service_client
 
 console = Console()
 
@@ -130,23 +130,9 @@ def merge_and_render_anomaly(
     None
         This function does not return any value.
     """
-    # === Set up the desired folder structure ==========================================
-    # This function will run inside an Azure Function, and be given a fresh file system
-    # each time it runs.
-    console.status("Setting up the desired folder structure")
-    root = Path(".") / release_name
-    internal_review = root / "internal-review"
-    meta = internal_review / "meta"
-    release = root / "release"
-    for d in [root, internal_review, release, meta]:
-        d.mkdir(parents=True, exist_ok=True)
-
     # === Set up blob service clients ==================================================
     console.status("Setting up blob service clients")
-    bsc = BlobServiceClient(
-        AzureStorage.AZURE_STORAGE_ACCOUNT_URL,
-        credential=DefaultAzureCredential(),
-    )
+    bsc: BlobServiceClient = get_blob_service_client()
     input_ctr_client: ContainerClient = bsc.get_container_client(
         rt_output_container_name
     )
@@ -166,259 +152,161 @@ def merge_and_render_anomaly(
         and (b.creation_time <= max_runat)
     ]
     console.status(f"Found {len(metadata_files)} metadata files")
+    # Nothing ran in this window, so there is nothing to merge. read_json() would also
+    # fail on a glob that matches no files
+    if not metadata_files:
+        console.log("No metadata files found between min_runat and max_runat. Exiting.")
+        return
+
+    # === Set up the desired folder structure ==========================================
+    # This function will run inside an Azure Function, and be given a fresh file system
+    # each time it runs. Only create it once there are files to put in it, and remove
+    # it on every exit below, as the worker can outlive many runs.
+    console.status("Setting up the desired folder structure")
+    root = Path(".") / release_name
+    internal_review = root / "internal-review"
+    meta = internal_review / "meta"
+    release = root / "release"
+    for d in [root, internal_review, release, meta]:
+        d.mkdir(parents=True, exist_ok=True)
+
     # Download the metadata files into the internal-review folder
-    for mf in track(metadata_files, description="Downloading metadata files"):
-        to_write = meta / mf
-        to_write.parent.mkdir(parents=True, exist_ok=True)
-        with open(to_write, "wb") as f:
-            f.write(input_ctr_client.download_blob(mf).readall())
+    download_blobs(
+        input_ctr_client,
+        metadata_files,
+        local_root=meta,
+        description="Downloading metadata files",
+    )
 
     # === Using the metadata files, get the tasks we want to merge =================
     md_path = str(meta / "**/metadata.json")
 
-    # Use duckdb here bc polars apparently can't read multiple json files unless they are
-    # ndjson, and these are not
-    conn = duckdb.connect()
-
-    prod_runs: pl.DataFrame = (
-        # Find all the metadata files
-        conn.sql(f"SELECT * FROM read_json('{md_path}', auto_detect=true)")
-        .pl()
-        # Make run_at a datetime. Do it in polars bc doing it in duckdb loses the tzinfo
-        # when transferring to polars
-        .with_columns(pl.col.run_at.str.to_datetime("%Y-%m-%dT%H:%M:%S%z"))
-        # Filter by the run at times
-        .filter(pl.col.run_at.is_between(min_runat, max_runat, closed="both"))
-        .sort("run_at")
-        # Keep just the most recently run tasks
-        .unique(subset=["disease", "geo_value", "production_date"], keep="last")
-        # Add paths to the samples and summaries from inside the blob container.
-        # These are not necessarily the same as the sample and summary paths in the
-        # metadata files, so we need to add them here so we know where to look in
-        # the blob container.
-        .with_columns(
-            blob_samples_path=pl.col.job_id + "/samples/" + pl.col.task_id + ".parquet",
-            blob_summaries_path=pl.col.job_id
-            + "/summaries/"
-            + pl.col.task_id
-            + ".parquet",
+    # This request's duckdb connection (and its cursors) isn't needed past the merges.
+    # Close it as soon as they finish, or fail, to free its memory before the reports
+    # are rendered.
+    with duckdb.connect() as conn:
+        prod_runs: pl.DataFrame = (
+            read_task_metadata(conn, md_path, min_runat=min_runat, max_runat=max_runat)
+            # Add paths to the samples and summaries from inside the blob container.
+            # These are not necessarily the same as the sample and summary paths in the
+            # metadata files, so we need to add them here so we know where to look in
+            # the blob container.
+            .with_columns(
+                blob_samples_path=pl.col.job_id
+                + "/samples/"
+                + pl.col.task_id
+                + ".parquet",
+                blob_summaries_path=pl.col.job_id
+                + "/summaries/"
+                + pl.col.task_id
+                + ".parquet",
+            )
         )
-    )
-    # Filter by the production date if provided
-    if prod_date is not None:
-        prod_runs = prod_runs.filter(pl.col.production_date.eq(prod_date))
-
-    console.log(f"Found {len(prod_runs)} tasks to merge")
-    # === Create the <release-name>/interal_review/<job_id>/ folders ===============
-    # Get the unique job-ids
-    job_ids: list[str] = prod_runs.get_column("job_id").unique().to_list()
-
-    # Create the job folders
-    for job_id in job_ids:
-        job_folder = internal_review / job_id
-        job_folder.mkdir(parents=True, exist_ok=True)
-
-    # === Merge the sample files ===================================================
-    # Download the samples files
-    local_sample_files: list[Path] = []
-    for sf in track(
-        prod_runs.get_column("blob_samples_path"),
-        description="Downloading samples",
-    ):
-        lsf: Path = internal_review / sf
-        lsf.parent.mkdir(parents=True, exist_ok=True)
-        local_sample_files.append(lsf)
-        with lsf.open("wb") as f:
-            f.write(input_ctr_client.download_blob(sf).readall())
-
-    # Sort for nicer sorting in the final parquet
-    local_sample_files.sort()
-
-    # Create a string of the file names readable by duckdb
-    lsf_str = ",".join("'" + str(p) + "'" for p in local_sample_files)
-
-    # Merge the files
-    final_samples = internal_review / "samples.parquet"
-    console.log("Merging the sample files")
-    console.log(local_sample_files)
-
-    # Merge the files with duckdb for better RAM usage
-    conn.sql(
-        f"""
-    CREATE VIEW samples AS FROM
-    read_parquet([{lsf_str}]);
-
-    COPY samples TO '{str(final_samples)}'
-    -- compression level only works with zstd. Compress a lot so we can fit on
-    -- the Azure Function node disk space. min 1, max 22
-    (CODEC 'zstd', COMPRESSION_LEVEL 15);
-    """
-    )
-
-    # === Merge the summary files ==================================================
-    # Download the summary files
-    local_summary_files: list[Path] = []
-    for sf in track(
-        prod_runs.get_column("blob_summaries_path"),
-        description="Downloading summaries",
-    ):
-        lsf: Path = internal_review / sf
-        lsf.parent.mkdir(parents=True, exist_ok=True)
-        local_summary_files.append(lsf)
-        with lsf.open("wb") as f:
-            f.write(input_ctr_client.download_blob(sf).readall())
-
-    # Sort for nicer sorting in the final parquet
-    local_summary_files.sort()
-
-    # Create a string of the file names readable by duckdb
-    lsf_str = ",".join("'" + str(p) + "'" for p in local_summary_files)
-
-    # Merge the files
-    final_summaries = internal_review / "summaries.parquet"
-    console.log("Merging the summary files")
-    console.log(local_summary_files)
-
-    # Merge the files with duckdb for better RAM usage
-    conn.sql(
-        f"""
-    CREATE VIEW summaries AS FROM
-    read_parquet([{lsf_str}]);
-
-    COPY summaries TO '{str(final_summaries)}'
-    -- compression level only works with zstd. Compress a lot so we can fit on
-    -- the Azure Function node disk space. min 1, max 22
-    (CODEC 'zstd', COMPRESSION_LEVEL 15);
-    """
-    )
-
-    # === Upload the merged files to the post-process container ========================
-    console.status("Uploading the merged files to the post-process container")
-    try:
-        with final_summaries.open("rb") as data:
-            output_ctr_client.upload_blob(
-                name=str(final_summaries),
-                data=data,
-                overwrite=overwrite_blobs,
+        # Filter by the production date if provided
+        if prod_date is not None:
+            prod_runs = prod_runs.filter(pl.col.production_date.eq(prod_date))
+        # Each task covers a single disease and geo_value. Merging the task files in
+        # this order keeps each disease and geo_value in adjacent row groups of the
+        # merged files, so readers filtering on them can skip the rest using the row
+        # group statistics, without having to sort the merged rows.
+        prod_runs = prod_runs.sort(["disease", "geo_value"])
+
+        console.log(f"Found {len(prod_runs)} tasks to merge")
+        if prod_runs.is_empty():
+            console.log("No tasks to merge. Exiting.")
+            rmtree(root)
+            return
+
+        # === Download and merge the sample and summary files =======================
+        # download_blobs() creates the <release-name>/internal-review/<job_id>/ folders
+        final_samples = internal_review / "samples.parquet"
+        final_summaries = internal_review / "summaries.parquet"
+
+        # Merge the files with duckdb as soon as they are downloaded, so the samples
+        # merge (CPU bound) runs while the summaries download (network bound). duckdb
+        # releases the GIL while it runs. Each thread needs its own cursor on the
+        # connection.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            local_sample_files: list[Path] = download_blobs(
+                input_ctr_client,
+                prod_runs.get_column("blob_samples_path").to_list(),
+                local_root=internal_review,
+                description="Downloading samples",
             )
-            console.log(
-                f"Uploaded the summaries to {output_ctr_client.url}/{final_summaries}"
+            console.log("Merging the sample files")
+            console.log(local_sample_files)
+            samples_merge = executor.submit(
+                merge_parquet_files, conn.cursor(), local_sample_files, final_samples
             )
-    except Exception as e:
-        console.log(f"Failed to upload the summaries: {e}")
 
-    try:
-        with final_samples.open("rb") as data:
-            output_ctr_client.upload_blob(
-                name=str(final_samples),
-                data=data,
-                overwrite=overwrite_blobs,
+            local_summary_files: list[Path] = download_blobs(
+                input_ctr_client,
+                prod_runs.get_column("blob_summaries_path").to_list(),
+                local_root=internal_review,
+                description="Downloading summaries",
             )
-            console.log(
-                f"Uploaded the samples to {output_ctr_client.url}/{final_samples}"
+            console.log("Merging the summary files")
+            console.log(local_summary_files)
+            summaries_merge = executor.submit(
+                merge_parquet_files, conn.cursor(), local_summary_files, final_summaries
             )
-    except Exception as e:
-        console.log(f"Failed to upload the samples: {e}")
 
-    # Upload the metadata df as a parquet file
+            samples_merge.result()
+            summaries_merge.result()
+
+    # === Upload the merged files to the post-process container ========================
+    console.status("Uploading the merged files to the post-process container")
+    # Upload the metadata df as a parquet file, along with the merged files
     md_file = internal_review / "metadata.parquet"
     prod_runs.write_parquet(md_file)
-    try:
-        with md_file.open("rb") as data:
-            output_ctr_client.upload_blob(
-                name=str(md_file),
-                data=data,
-                overwrite=overwrite_blobs,
-            )
-            console.log(f"Uploaded the metadata to {output_ctr_client.url}/{md_file}")
-    except Exception as e:
-        console.log(f"Failed to upload the metadata: {e}")
+    upload_files(
+        output_ctr_client,
+        [
+            (final_summaries, str(final_summaries)),
+            (final_samples, str(final_samples)),
+            (md_file, str(md_file)),
+        ],
+        overwrite=overwrite_blobs,
+    )
 
     # === Render and upload anomaly report =============================================
     console.status("Rendering the anomaly reports")
     covid_report = internal_review / "covid_anomaly_report.html"
     flu_report = internal_review / "influenza_anomaly_report.html"
-    try:
-        # COVID-19
-        render_report(
-            disease="COVID-19",
-            desired_output_location=covid_report,
-            summary_loc=final_summaries,
-            samples_loc=final_samples,
-            metadata_file=md_file,
-        )
-    except Exception as e:
-        console.log(f"Failed to render the COVID-19 anomaly report: {e}")
-
-    try:
-        # Influenza
-        render_report(
-            disease="Influenza",
-            desired_output_location=flu_report,
-            summary_loc=final_summaries,
-            samples_loc=final_samples,
-            metadata_file=md_file,
-        )
-    except Exception as e:
-        console.log(f"Failed to render the Influenza anomaly report: {e}")
-
-    # Upload the reports
-    try:
-        if covid_report.exists():
-            # To the usual location in the folder for this run
-            with covid_report.open("rb") as data:
-                output_ctr_client.upload_blob(
-                    name=str(covid_report),
-                    data=data,
-                    overwrite=overwrite_blobs,
-                )
-            console.log(
-                (
-                    f"Uploaded the covid anomaly report to {output_ctr_client.url}/{covid_report}"
-                    f" and to {output_ctr_client.url}/latest_anomaly_report_covid.html"
-                )
+    # Each report renders in its own quarto process, so render them at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        renders = {
+            disease: executor.submit(
+                render_report,
+                disease=disease,
+                desired_output_location=report,
+                summary_loc=final_summaries,
+                samples_loc=final_samples,
+                metadata_file=md_file,
             )
-
-            # To /latest_anomaly_report_covid.html in the container
-            with covid_report.open("rb") as data:
-                output_ctr_client.upload_blob(
-                    name="latest_anomaly_report_covid.html",
-                    data=data,
-                    overwrite=overwrite_blobs,
-                )
+            for disease, report in [
+                ("COVID-19", covid_report),
+                ("Influenza", flu_report),
+            ]
+        }
+        for disease, render in renders.items():
+            try:
+                render.result()
+            except Exception as e:
+                console.log(f"Failed to render the {disease} anomaly report: {e}")
+
+    # Upload the reports, to the usual location in the folder for this run, and to
+    # /latest_anomaly_report_<disease>.html in the container
+    report_uploads: list[tuple[Path, str]] = []
+    for report, latest_name in [
+        (covid_report, "latest_anomaly_report_covid.html"),
+        (flu_report, "latest_anomaly_report_flu.html"),
+    ]:
+        if report.exists():
+            report_uploads += [(report, str(report)), (report, latest_name)]
         else:
-            console.log("No covid report to upload. Skipping.")
-    except Exception as e:
-        console.log(f"Failed to upload the anomaly report: {e}")
-
-    try:
-        if flu_report.exists():
-            # To the usual location in the folder for this run
-            with flu_report.open("rb") as data:
-                output_ctr_client.upload_blob(
-                    name=str(flu_report),
-                    data=data,
-                    overwrite=overwrite_blobs,
-                )
-
-            # To /latest_anomaly_report_flu.html in the container
-            with flu_report.open("rb") as data:
-                output_ctr_client.upload_blob(
-                    name="latest_anomaly_report_flu.html",
-                    data=data,
-                    overwrite=overwrite_blobs,
-                )
-
-            console.log(
-                (
-                    f"Uploaded the flu anomaly report to {output_ctr_client.url}/{flu_report}"
-                    f" and to {output_ctr_client.url}/latest_anomaly_report_flu.html"
-                )
-            )
-        else:
-            console.log("No flu report to upload. Skipping.")
-    except Exception as e:
-        console.log(f"Failed to upload the flu anomaly report: {e}")
+            console.log(f"No {report.name} to upload. Skipping.")
+    upload_files(output_ctr_client, report_uploads, overwrite=overwrite_blobs)
 
     # === Calculate the categories for the samples =====================================
     console.status("Calculating the categories from the samples")
@@ -431,36 +319,23 @@ def merge_and_render_anomaly(
     p_growing.write_csv(p_growing_csv_file)
 
     # Upload the files
-    try:
-        with p_growing_pq_file.open("rb") as data:
-            output_ctr_client.upload_blob(
-                name=str(p_growing_pq_file),
-                data=data,
-                overwrite=overwrite_blobs,
-            )
-            console.log(
-                f"Uploaded the p_growing parquet to {output_ctr_client.url}/{p_growing_pq_file}"
-            )
-
-        with p_growing_csv_file.open("rb") as data:
-            output_ctr_client.upload_blob(
-                name=str(p_growing_csv_file),
-                data=data,
-                overwrite=overwrite_blobs,
-            )
-            console.log(
-                f"Uploaded the p_growing csv to {output_ctr_client.url}/{p_growing_csv_file}"
-            )
-    except Exception as e:
-        console.log(f"Failed to upload the p_growing files: {e}")
+    upload_files(
+        output_ctr_client,
+        [
+            (p_growing_pq_file, str(p_growing_pq_file)),
+            (p_growing_csv_file, str(p_growing_csv_file)),
+        ],
+        overwrite=overwrite_blobs,
+    )
 
     # === Update the production index ==================================================
     if is_prod_run:
-        # Get the production index blobs
+        # Get the production index blobs. Let the service match the prefix, rather than
+        # listing the whole container
         prod_idx_blobs: list[BlobProperties] = [
             b
-            for b in output_ctr_client.list_blobs()
-            if b.name.startswith("production_index") and b.name.endswith(".csv")
+            for b in output_ctr_client.list_blobs(name_starts_with="production_index")
+            if b.name.endswith(".csv")
         ]
         console.log(f"Found {len(prod_idx_blobs)} production index files")
         # Find the most recent one
@@ -469,12 +344,13 @@ def merge_and_render_anomaly(
         )
         console.log(f"Using most recent production index: {most_recent_prod_idx.name}")
 
-        # Download the production index
-        csv_bytes_io = BytesIO(
-            output_ctr_client.download_blob(most_recent_prod_idx.name).readall()
-        )
+        # Download the production index. polars parses the bytes directly, with the
+        # schema given up front, so there's no need to wrap them in a BytesIO
+        csv_bytes: bytes = output_ctr_client.download_blob(
+            most_recent_prod_idx.name
+        ).readall()
         production_index = pl.read_csv(
-            csv_bytes_io,
+            csv_bytes,
             schema=pl.Schema(
                 [
                     ("release_date", pl.Date),
@@ -532,11 +408,198 @@ def merge_and_render_anomaly(
             console.log(f"Failed to upload the production index: {e}")
 
     # === Clean up =====================================================================
-    conn.close()
     console.log(f"Cleaning up {root} folder")
     rmtree(root)
 
 
+def download_blobs(
+    container_client: ContainerClient,
+    blob_names: list[str],
+    local_root: Path,
+    description: str = "Downloading blobs",
+    max_workers: int = 10,
+) -> list[Path]:
+    """
+    Download blobs from a container into the same paths under a local folder. The
+    downloads are network bound, so run several of them at once.
+
+    Parameters
+    ----------
+    container_client : ContainerClient
+        The container to download from.
+    blob_names : list[str]
+        The names of the blobs to download.
+    local_root : Path
+        The folder to download into. Each blob is written to `local_root / name`.
+    description : str, optional
+        The description for the progress bar.
+    max_workers : int, optional
+        The number of downloads to run at once. Default is 10, the size of the SDK's
+        connection pool.
+
+    Returns
+    -------
+    list[Path]
+        The local paths of the downloaded files, in the same order as `blob_names`.
+    """
+    local_files: list[Path] = [local_root / name for name in blob_names]
+    # Create the folders up front, so the download threads don't race to create them
+    for folder in {lf.parent for lf in local_files}:
+        folder.mkdir(parents=True, exist_ok=True)
+
+    def download_one(blob_name: str, local_file: Path):
+        # Stream each blob straight into its file, rather than reading the whole blob
+        # into memory first. The samples files can be hundreds of MB.
+        with local_file.open("wb") as f:
+            container_client.download_blob(blob_name).readinto(f)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(download_one, name, lf)
+            for name, lf in zip(blob_names, local_files)
+        ]
+        for future in track(
+            as_completed(futures), total=len(futures), description=description
+        ):
+            # Raise any errors from the download
+            future.result()
+
+    return local_files
+
+
+def upload_files(
+    container_client: ContainerClient,
+    uploads: list[tuple[Path, str]],
+    overwrite: bool = False,
+    max_workers: int = 2,
+    max_concurrency: int = 8,
+):
+    """
+    Upload local files to a container, several at a time. A failed upload is logged
+    rather than raised, so that it doesn't stop the others.
+
+    Parameters
+    ----------
+    container_client : ContainerClient
+        The container to upload to.
+    uploads : list[tuple[Path, str]]
+        The local file, and the name of the blob to upload it to, for each upload.
+    overwrite : bool, optional
+        If True, overwrite existing blobs. Default is False.
+    max_workers : int, optional
+        The number of files to upload at once. Default is 2.
+    max_concurrency : int, optional
+        The number of blocks of each file to upload at once. Default is 8. Each block
+        upload takes a connection. The SDK's HTTP pool keeps 10 connections, but doesn't
+        block on them: connections past those are opened for the request and closed
+        after it. So `max_workers * max_concurrency` well past 10 costs connection
+        churn, rather than waiting.
+    """
+
+    def upload_one(local_file: Path, blob_name: str):
+        # The merged files can be hundreds of MB, so also upload the blocks of each
+        # file in parallel. The SDK gets the file's length from the open file, so it
+        # can split it into blocks up front.
+        with local_file.open("rb") as data:
+            container_client.upload_blob(
+                name=blob_name,
+                data=data,
+                overwrite=overwrite,
+                max_concurrency=max_concurrency,
+            )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(upload_one, local_file, blob_name): blob_name
+            for local_file, blob_name in uploads
+        }
+        for future in as_completed(futures):
+            blob_name = futures[future]
+            try:
+                future.result()
+                console.log(f"Uploaded {container_client.url}/{blob_name}")
+            except Exception as e:
+                console.log(f"Failed to upload {blob_name}: {e}")
+
+
+def read_task_metadata(
+    conn: duckdb.DuckDBPyConnection,
+    md_path: str,
+    min_runat: datetime,
+    max_runat: datetime,
+) -> pl.DataFrame:
+    """
+    Read the tasks' metadata files, and keep the most recent run of each disease,
+    geo_value, and production_date run between `min_runat` and `max_runat`
+    (inclusive). Filtering and deduplicating happen in the same pass over the files.
+
+    Parameters
+    ----------
+    conn : duckdb.DuckDBPyConnection
+        The duckdb connection to read the files with. Its time zone is set to UTC.
+    md_path : str
+        The path, or glob, of the metadata files (EX: "meta/**/metadata.json").
+    min_runat : datetime
+        The earliest run_at time to keep.
+    max_runat : datetime
+        The latest run_at time to keep.
+
+    Returns
+    -------
+    pl.DataFrame
+        One row per task, with run_at as a UTC datetime.
+    """
+    # duckdb hands timestamps with time zones to polars in the session's time zone,
+    # which defaults to the local one. Use UTC, as the run_at times are compared in
+    # UTC.
+    conn.execute("SET TimeZone = 'UTC'")
+    # Use duckdb here bc polars apparently can't read multiple json files unless they are
+    # ndjson, and these are not
+    return conn.sql(
+        """
+        WITH metadata AS (
+            SELECT * REPLACE (strptime(run_at, '%Y-%m-%dT%H:%M:%S%z') AS run_at)
+            FROM read_json($md_path, auto_detect=true)
+        )
+        SELECT * FROM metadata
+        WHERE run_at BETWEEN $min_runat AND $max_runat
+        QUALIFY row_number() OVER (
+            PARTITION BY disease, geo_value, production_date ORDER BY run_at DESC
+        ) = 1
+        """,
+        params={"md_path": md_path, "min_runat": min_runat, "max_runat": max_runat},
+    ).pl()
+
+
+def merge_parquet_files(
+    conn: duckdb.DuckDBPyConnection, parquet_files: list[Path], output_file: Path
+):
+    """
+    Merge parquet files into a single parquet file, in the order given. Use duckdb for
+    better RAM usage, as it streams the rows through rather than reading every file
+    into memory.
+
+    Parameters
+    ----------
+    conn : duckdb.DuckDBPyConnection
+        The duckdb connection (or cursor) to run the merge on.
+    parquet_files : list[Path]
+        The parquet files to merge.
+    output_file : Path
+        Where to write the merged parquet file.
+    """
+    # Pass the file names as a parameter, rather than writing them all into the query
+    conn.sql(
+        f"""
+    COPY (FROM read_parquet($parquet_files)) TO '{str(output_file)}'
+    -- compression level only works with zstd. Compress a lot so we can fit on
+    -- the Azure Function node disk space. min 1, max 22
+    (CODEC 'zstd', COMPRESSION_LEVEL 15);
+    """,
+        params={"parquet_files": [str(p) for p in parquet_files]},
+    )
+
+
 def render_report(
     disease: str,
     desired_output_location: Path,
@@ -545,19 +608,35 @@ def render_report(
     metadata_file: Path,
     unrendered_location: Path = Path("src/cfa_rt_postprocessing/anomaly_report.qmd"),
 ):
-    quarto.render(
-        input=unrendered_location,
-        execute_params={
-            "summary_file": str(summary_loc.absolute()),
-            "samples_file": str(samples_loc.absolute()),
-            "metadata_file": str(metadata_file.absolute()),
-            "disease": disease,
-        },
-    )
+    # Render a copy of the report in a folder of its own. quarto writes its
+    # intermediate files, and its .quarto state, next to the report, so this keeps
+    # renders for different diseases from sharing them when they run at the same time,
+    # and leaves nothing behind in the package if a render fails.
+    with TemporaryDirectory(prefix=f"anomaly_report_{disease}_") as render_dir:
+        to_render = Path(render_dir) / unrendered_location.name
+        copyfile(unrendered_location, to_render)
+        quarto.render(
+            input=to_render,
+            execute_params={
+                "summary_file": str(summary_loc.absolute()),
+                "samples_file": str(samples_loc.absolute()),
+                "metadata_file": str(metadata_file.absolute()),
+                "disease": disease,
+            },
+            # Run the report's code from the package folder, so it can import the
+            # package's modules by their top-level names
+            execute_dir=str(unrendered_location.parent.absolute()),
+        )
+
+        # quarto.render() doesn't raise when the render fails, it just doesn't write
+        # the report
+        rendered_report = to_render.with_suffix(".html")
+        if not rendered_report.exists():
+            raise RuntimeError(f"quarto failed to render the {disease} report")
 
-    # Move the rendered report to the internal-review folder
-    rendered_report = unrendered_location.parent / (unrendered_location.stem + ".html")
-    rendered_report.replace(desired_output_location)
+        # Move the rendered report to the internal-review folder. The temporary folder
+        # may be on another file system, so move rather than rename it.
+        move(rendered_report, desired_output_location)
     console.status(
         f"Moved the rendered {disease} report to {str(desired_output_location)}"
     )
@@ -589,16 +668,19 @@ def calculate_categories(samples_file: Path) -> pl.DataFrame:
     FROM '{str(samples_file.absolute())}'
     WHERE "_variable" = 'Rt';
 
-    -- Calculate the p_growing for each geo_value, disease, and reference_date
+    -- Calculate the p_growing for each geo_value, disease, and reference_date. Count
+    -- the growing samples with a filter, rather than averaging a 0/1 per sample
     CREATE OR REPLACE TABLE p_growing AS SELECT
     geo_value, disease, reference_date,
-    AVG(IF(Rt > 1, 1, 0)) AS p_growing,
+    COUNT(*) FILTER (WHERE Rt > 1) / COUNT(*) AS p_growing,
+    -- p_growing is a proportion, so always in [0, 1]. Check the upper bound of each
+    -- bin in turn, so each group only needs one comparison per bin it is above
     CASE
-        WHEN (p_growing > 0.9) AND (p_growing <= 1.0) THEN 'Growing'
-        WHEN (p_growing > 0.75) AND (p_growing <= 0.9) THEN 'Likely Growing'
-        WHEN (p_growing > 0.25) AND (p_growing <= 0.75) THEN 'Not Changing'
-        WHEN (p_growing > 0.10) AND (p_growing <= 0.25) THEN 'Likely Declining'
-        WHEN (p_growing >= 0.0) AND (p_growing <= 0.10) THEN 'Declining'
+        WHEN p_growing <= 0.10 THEN 'Declining'
+        WHEN p_growing <= 0.25 THEN 'Likely Declining'
+        WHEN p_growing <= 0.75 THEN 'Not Changing'
+        WHEN p_growing <= 0.9 THEN 'Likely Growing'
+        ELSE 'Growing'
     END AS five_cat_p_growing
     FROM samples
     GROUP BY ALL
@@ -1,23 +1,124 @@
+import copy
+import json
+
 import altair as alt
 import numpy as np
 import polars as pl
 from vega_datasets import data
 
+# The shape of the choropleth never changes, so keep the Vega-Lite spec here and only
+# fill in the data, the color scale, and the size per call. Going through Altair's
+# fluent API validates the whole schema on every call, which is slow.
+_CHOROPLETH_SPEC: dict = {
+    "$schema": alt.SCHEMA_URL,
+    "data": {"url": None, "format": {"type": "topojson", "feature": None}},
+    "mark": {"type": "geoshape", "stroke": "white", "strokeWidth": 1.5},
+    "projection": {"type": "albersUsa"},
+    "transform": [
+        {
+            "lookup": "id",
+            "from": {"data": {"name": "p_growing"}, "key": "id", "fields": None},
+        }
+    ],
+    "encoding": {
+        "color": {
+            "field": "cat",
+            "type": "nominal",
+            "scale": {"domain": None, "range": None},
+            "legend": {"title": "P(growing)", "orient": "right"},
+        },
+        "tooltip": [
+            {"field": "state", "type": "nominal", "title": "State"},
+            {"field": "p_growing", "type": "quantitative", "title": "P(growing)"},
+        ],
+    },
+    "params": [
+        {
+            "name": "param_1",
+            "select": {"type": "interval", "encodings": ["x", "y"]},
+            "bind": "scales",
+        }
+    ],
+    "width": None,
+    "height": None,
+    "datasets": {"p_growing": None},
+}
+
+
+def bin_p_growing(p_growing: pl.DataFrame) -> tuple[pl.DataFrame, dict[str, str]]:
+    """
+    Bin `p_growing` into 5 categories, and assign a color to each category. Returns the
+    binned DataFrame and a mapping from category to hex color.
+    """
+    thresholds, cats, hexes = five_cat_hexcolor()
+    values = p_growing.get_column("p_growing").cast(pl.Float64).to_numpy()
+    # Each bin is closed on the right, e.g. (0.10, 0.25], so search on the left side.
+    # The categories start with "Not Estimated", which takes the missing values, so the
+    # bins start at 1.
+    idx = np.where(
+        np.isnan(values),
+        0,
+        np.searchsorted(thresholds, values, side="left") + 1,
+    )
+    df = p_growing.with_columns(
+        pl.Series("cat", cats[idx]),
+        pl.Series("hex", hexes[idx]),
+    )
+
+    return df, dict(zip(cats.tolist(), hexes.tolist()))
+
+
+def create_choropleth_vl(
+    p_growing: pl.DataFrame,
+    states_url: str,
+    feature: str = "states",
+    width: int = 750,
+    height: int = 750,
+) -> dict:
+    """
+    Create a choropleth map of the US states with the probability of growing.
+    Return the Vega-Lite spec as a dict, which can be written straight to disk with
+    `json.dumps`, or wrapped with `alt.Chart.from_dict` when an altair object is
+    needed.
+    """
+    df, cats = bin_p_growing(p_growing)
+
+    spec = copy.deepcopy(_CHOROPLETH_SPEC)
+    spec["data"]["url"] = states_url
+    spec["data"]["format"]["feature"] = feature
+    spec["transform"][0]["from"]["fields"] = df.columns
+    spec["encoding"]["color"]["scale"]["domain"] = list(cats.keys())
+    spec["encoding"]["color"]["scale"]["range"] = list(cats.values())
+    spec["width"] = width
+    spec["height"] = height
+    spec["datasets"]["p_growing"] = df.to_dicts()
+
+    return spec
 
-def create_choropleth(p_growing: pl.DataFrame, states: alt.ChartDataType) -> alt.Chart:
+
+def create_choropleth(
+    p_growing: pl.DataFrame, states: alt.ChartDataType, use_altair: bool = False
+) -> alt.Chart:
     """
     Create a choropleth map of the US states with the probability of growing.
     Return the altair chart object.
+
+    When `states` is a TopoJSON URL, e.g. from `alt.topo_feature`, the chart is built
+    from the Vega-Lite spec in `create_choropleth_vl` without schema validation. Other
+    sources, or `use_altair=True`, build it with altair's fluent API instead.
     """
-    # Bin `p_growing` into 5 categories, and assign a color to each category
-    categories = five_cat_hexcolor()
-    df = p_growing.join_asof(
-        categories,
-        left_on="p_growing",
-        right_on="upper_threshold",
-        strategy="forward",
+    is_topojson_url = (
+        isinstance(states, alt.UrlData)
+        and isinstance(states.format, alt.TopoDataFormat)
+        and states.format.feature is not alt.Undefined
     )
-    cats = dict(zip(categories["cat"], categories["hex"]))
+    if is_topojson_url and not use_altair:
+        spec = create_choropleth_vl(
+            p_growing, states_url=states.url, feature=states.format.feature
+        )
+        return alt.Chart.from_dict(spec, validate=False)
+
+    df, cats = bin_p_growing(p_growing)
 
     return (
         alt.Chart(states)
@@ -101,24 +202,27 @@ def states() -> list[str]:
     ]
 
 
-def five_cat_hexcolor() -> pl.DataFrame:
-    df = pl.DataFrame(
-        dict(
-            cat=[
-                "Growing",
-                "Likely Growing",
-                "Not Changing",
-                "Likely Declining",
-                "Declining",
-                "Not Estimated",
-            ],
-            #     purple,    pink,       grey,      teal,    dark teal,  white
-            hex=["#6d085a", "#b83d93", "#bdbdbd", "#3bbbb0", "#006166", "#ffffff"],
-            lower_threshold=[0.9, 0.75, 0.25, 0.10, 0.0, None],
-            upper_threshold=[1.0, 0.9, 0.75, 0.25, 0.10, None],
-        )
-    ).sort("upper_threshold")
-    return df
+def five_cat_hexcolor() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the upper thresholds between the five categories, and the name and hex
+    color of each category, ordered from declining to growing. The names and colors
+    start with a "Not Estimated" entry for missing values, which is also the order of
+    the legend.
+    """
+    thresholds = np.array([0.10, 0.25, 0.75, 0.9])
+    cats = np.array(
+        [
+            "Not Estimated",
+            "Declining",
+            "Likely Declining",
+            "Not Changing",
+            "Likely Growing",
+            "Growing",
+        ]
+    )
+    #                 white,     dark teal, teal,      grey,      pink,      purple
+    hexes = np.array(["#ffffff", "#006166", "#3bbbb0", "#bdbdbd", "#b83d93", "#6d085a"])
+    return thresholds, cats, hexes
 
 
 if __name__ == "__main__":
@@ -126,11 +230,16 @@ if __name__ == "__main__":
 
     # Create some fake p_growing data
     N = 60
+    rng = np.random.default_rng()
     p_growing = pl.DataFrame(
         dict(
-            id=range(0, N),
-            state=np.random.choice(states(), N),
-            p_growing=np.random.rand(N),
+            id=np.arange(N),
+            state=rng.choice(states(), size=N),
+            p_growing=rng.random(N),
         )
     ).sort("p_growing")
     create_choropleth(p_growing, states_data).save("choropleth.html")
+
+    # The spec can also be written out directly, without going through altair
+    with open("choropleth.vl.json", "w") as f:
+        json.dump(create_choropleth_vl(p_growing, states_data.url), f)
@@ -4,6 +4,30 @@ import altair as alt
 import polars as pl
 
 
+def split_rt_by_state(
+    summary: pl.DataFrame, states: list[str], disease: str, report_date: date
+) -> dict[str, pl.DataFrame]:
+    """
+    Filter the summary to a disease's Rt estimates once, and split them into the rows
+    plot_rt() needs for each state: the state's own, and the US's. Use this to plot
+    many states without filtering the whole summary again for each one.
+    """
+    rt = summary.filter(
+        pl.col.disease.eq(disease),
+        pl.col("_variable").eq("Rt"),
+        pl.col.reference_date.le(report_date),
+    )
+    by_geo: dict[str, pl.DataFrame] = {
+        geo_value: df
+        for (geo_value,), df in rt.partition_by("geo_value", as_dict=True).items()
+    }
+    us = by_geo.get("US", rt.clear())
+    return {
+        state: us if state == "US" else pl.concat([us, by_geo.get(state, rt.clear())])
+        for state in states
+    }
+
+
 def plot_rt(
     summary: pl.DataFrame,
     state: str,
@@ -43,16 +67,22 @@ def plot_rt(
         range=["#1F77B4", "#1F77B4", "#1F77B4", "#767676", "#767676", "#767676"],
     )
 
+    # Split the rows by width in a single pass, rather than filtering `df` once per
+    # plot layer. The median and the 50% width both come from the 0.5 rows.
+    widths: dict[tuple, pl.DataFrame] = df.partition_by("_width", as_dict=True)
+    width_50_rows = widths.get((0.5,), df.clear())
+    width_95_rows = widths.get((0.95,), df.clear())
+
+    # Each layer's frame is embedded in the chart as JSON, so only select the columns
+    # it encodes
     # Plot the median Rt estimates
     # Median is stored in the `value` column, and has duplicates for each quantile
-    med = (
-        df.filter(pl.col("_width").eq(0.5))
-        .select(["value", "reference_date", "geo_value"])
-        .with_columns(
-            label=pl.when(pl.col.geo_value.eq("US"))
-            .then(pl.lit("US Median"))
-            .otherwise(pl.lit(f"{state} Median"))
-        )
+    med = width_50_rows.select(
+        "value",
+        "reference_date",
+        label=pl.when(pl.col.geo_value.eq("US"))
+        .then(pl.lit("US Median"))
+        .otherwise(pl.lit(f"{state} Median")),
     )
     med_line = (
         alt.Chart(med, title=f"{state}-{disease} Rt estimates")
@@ -67,14 +97,13 @@ def plot_rt(
     # Plot the 95% width of the Rt estimates
     # The 95% width has values stored in _lower and _upper columns
     # The reference_date is the same for both columns
-    width_95 = (
-        df.filter(pl.col("_width").eq(0.95))
-        .select(["_lower", "_upper", "reference_date", "geo_value"])
-        .with_columns(
-            label=pl.when(pl.col.geo_value.eq("US"))
-            .then(pl.lit("US 95% Width"))
-            .otherwise(pl.lit(f"{state} 95% Width"))
-        )
+    width_95 = width_95_rows.select(
+        "_lower",
+        "_upper",
+        "reference_date",
+        label=pl.when(pl.col.geo_value.eq("US"))
+        .then(pl.lit("US 95% Width"))
+        .otherwise(pl.lit(f"{state} 95% Width")),
     )
     width_95_band = (
         alt.Chart(width_95)
@@ -88,14 +117,13 @@ def plot_rt(
     )
 
     # Plot the 50% width of the Rt estimates
-    width_50 = (
-        df.filter(pl.col("_width").eq(0.5))
-        .select(["_lower", "_upper", "reference_date", "geo_value"])
-        .with_columns(
-            label=pl.when(pl.col.geo_value.eq("US"))
-            .then(pl.lit("US 50% Width"))
-            .otherwise(pl.lit(f"{state} 50% Width"))
-        )
+    width_50 = width_50_rows.select(
+        "_lower",
+        "_upper",
+        "reference_date",
+        label=pl.when(pl.col.geo_value.eq("US"))
+        .then(pl.lit("US 50% Width"))
+        .otherwise(pl.lit(f"{state} 50% Width")),
     )
     width_50_band = (
         alt.Chart(width_50)
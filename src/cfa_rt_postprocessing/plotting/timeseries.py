@@ -1,8 +1,52 @@
 from typing import Literal
 
-import plotly.graph_objs as go
+import numpy as np
+import plotly.graph_objects as go
 import polars as pl
 
+# The layout is the same for every plot apart from the title, so build it once here
+# rather than updating each figure's layout after it is created
+_LAYOUT: dict = dict(
+    autosize=False,
+    width=700,
+    height=500,
+    legend=dict(
+        orientation="h",
+        yanchor="bottom",
+        y=-0.4,
+        xanchor="center",
+        x=0.5,
+    ),
+    template="plotly_white",
+    xaxis=dict(title=dict(text="Reference Date")),
+    yaxis=dict(title=dict(text="Incident ED Visits")),
+)
+
+
+def pack_polygon(
+    x: np.ndarray, upper: np.ndarray, lower: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pack the upper and lower bounds of a ribbon into a closed polygon: along the upper
+    bound, then back along the lower bound. Reversing a NumPy array is a view, so only
+    the concatenation copies.
+
+    Parameters
+    ----------
+    x: np.ndarray
+        x values shared by both bounds
+    upper: np.ndarray
+        upper bound of the ribbon
+    lower: np.ndarray
+        lower bound of the ribbon
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        x and y values of the polygon
+    """
+    return np.concatenate([x, x[::-1]]), np.concatenate([upper, lower[::-1]])
+
 
 def timeseries_plot(
     state: str,
@@ -48,17 +92,31 @@ def timeseries_plot(
         pl.col("geo_value") == state, pl.col("disease") == disease
     ).sort(["reference_date"])
 
+    # Convert the columns to NumPy once, rather than having plotly convert each polars
+    # column (and the shared x axis five times) when building the traces
+    x_obs = df_obs["reference_date"].to_numpy()
+    y_obs: dict[str, np.ndarray] = {
+        col: df_obs[col].to_numpy()
+        for col in [
+            "processed_obs_data",
+            "raw_obs_data",
+            "raw_obs_data_prev_wk",
+            "expected_obs_cases",
+            "expected_nowcast_cases",
+        ]
+    }
+
     # Line Traces
     est_current_reported_trace = go.Scatter(
-        x=df_obs["reference_date"],
-        y=df_obs["expected_obs_cases"],
+        x=x_obs,
+        y=y_obs["expected_obs_cases"],
         mode="lines",
         name="Est. Current Reported",
         line_color="black",
     )
     est_total_reported_trace = go.Scatter(
-        x=df_obs["reference_date"],
-        y=df_obs["expected_nowcast_cases"],
+        x=x_obs,
+        y=y_obs["expected_nowcast_cases"],
         mode="lines",
         name="Est. Total Reported",
         line=dict(dash="dash"),
@@ -67,23 +125,23 @@ def timeseries_plot(
 
     # Marker Traces
     processed_reported_trace = go.Scatter(
-        x=df_obs["reference_date"],
-        y=df_obs["processed_obs_data"],
+        x=x_obs,
+        y=y_obs["processed_obs_data"],
         mode="markers",
         name="Model input reported",
         marker=dict(symbol="circle"),
         visible="legendonly",
     )
     raw_reported_trace = go.Scatter(
-        x=df_obs["reference_date"],
-        y=df_obs["raw_obs_data"],
+        x=x_obs,
+        y=y_obs["raw_obs_data"],
         mode="markers",
         name="Raw Reported",
         marker=dict(symbol="circle", color="black"),
     )
     raw_prev_wk_reported_trace = go.Scatter(
-        x=df_obs["reference_date"],
-        y=df_obs["raw_obs_data_prev_wk"],
+        x=x_obs,
+        y=y_obs["raw_obs_data_prev_wk"],
         mode="markers",
         name="Raw Reported (Prev Week)",
         # A red cross
@@ -99,34 +157,20 @@ def timeseries_plot(
         raw_prev_wk_reported_trace,
     ]
 
-    # Create a figure with the collected traces
-    fig = go.Figure(
-        data=traces,
-        layout=go.Layout(
-            autosize=False,
-            width=700,
-            height=500,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=-0.4,
-                xanchor="center",
-                x=0.5,
-            ),
-            template="plotly_white",
-        ),
-    )
-
-    # Loop through each width group to add ribbon traces
-    for group in df_interval["_width"].unique():
-        group_data = df_interval.filter(pl.col("_width") == group)
+    # Loop through each width group to add ribbon traces. Split the intervals by width
+    # in one pass, rather than filtering once per width.
+    width_groups = df_interval.partition_by("_width", as_dict=True)
+    for (group,), group_data in width_groups.items():
+        xs, ys = pack_polygon(
+            x=group_data["reference_date"].to_numpy(),
+            upper=group_data["_upper_expected_nowcast_cases"].to_numpy(),
+            lower=group_data["_lower_expected_nowcast_cases"].to_numpy(),
+        )
         # Add trace for the ribbon area for each group
-        fig.add_trace(
+        traces.append(
             go.Scatter(
-                x=group_data["reference_date"].to_list()
-                + group_data["reference_date"].to_list()[::-1],
-                y=group_data["_upper_expected_nowcast_cases"].to_list()
-                + group_data["_lower_expected_nowcast_cases"].to_list()[::-1],
+                x=xs,
+                y=ys,
                 fill="toself",
                 fillcolor="rgba(75, 63, 63, 0.1)",  # light gray
                 line=dict(color="rgba(151, 127, 105, 0.05)"),  # nearly white
@@ -134,11 +178,10 @@ def timeseries_plot(
             )
         )
 
-    # Update the title
-    fig.update_layout(title=state + ": " + disease + " ED Visits")
-    # Update the x-axis title
-    fig.update_xaxes(title_text="Reference Date")
-    # Update the y-axis title
-    fig.update_yaxes(title_text="Incident ED Visits")
+    # Create a figure with the collected traces, and the title for this state
+    fig = go.Figure(
+        data=traces,
+        layout={**_LAYOUT, "title": state + ": " + disease + " ED Visits"},
+    )
 
     return fig
@@ -1,5 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import date, timedelta
-from io import BytesIO
+from functools import lru_cache
 
 import polars as pl
 from azure.storage.blob import (
@@ -10,8 +12,137 @@ from azure.storage.blob import (
 )
 
 
-def read_blob_file(
+@dataclass(frozen=True)
+class DateContext:
+    """
+    The dates used to build the plotting data for a single report date. Compute these
+    once per report, and pass them down.
+    """
+
+    end_date: date
+    past_week: date
+    date_cut_off: date
+
+    @classmethod
+    @lru_cache(maxsize=32)
+    def from_date(cls, end_date: date) -> "DateContext":
+        return cls(
+            end_date=end_date,
+            past_week=end_date - timedelta(days=7),
+            date_cut_off=end_date - timedelta(weeks=8),
+        )
+
+    @classmethod
+    def from_string(cls, end_date: str) -> "DateContext":
+        return cls.from_date(date.fromisoformat(end_date))
+
+
+# The columns of the gold and summary files that are used for plotting
+GOLD_COLUMNS: tuple[str, ...] = (
+    "metric",
+    "disease",
+    "reference_date",
+    "geo_value",
+    "value",
+)
+SUMMARY_COLUMNS: tuple[str, ...] = (
+    "time",
+    "reference_date",
+    "geo_value",
+    "disease",
+    "_variable",
+    "value",
+    "_lower",
+    "_upper",
+    "_width",
+)
+
+
+# The dtype of the geo_value and disease join keys. Joining and grouping on the
+# categorical encoding hashes small integers rather than strings. Frames that are
+# joined together must share a `pl.StringCache()` for their encodings to agree, so
+# the functions below return the keys as strings, and only prepare_plot_data() casts
+# them, inside its own string cache.
+JOIN_KEY_DTYPE = pl.Categorical(ordering="physical")
+JOIN_KEYS: tuple[str, ...] = ("geo_value", "disease")
+
+
+@lru_cache(maxsize=4)
+def _container(
+    blob_service_client: BlobServiceClient, container_name: str
+) -> ContainerClient:
+    """
+    Get a container client once per service client and container, rather than for
+    every blob read from it
+    """
+    return blob_service_client.get_container_client(container_name)
+
+
+def read_blob_bytes(
     container_name: str, blob_file_path: str, blob_service_client: BlobServiceClient
+) -> bytes:
+    """
+    Downloads a single file from blob into memory
+
+    Parameters
+    ----------
+    container_name: str
+        name of the container (EX: "nssp-rt-post-process")
+    blob_file_path: str
+        name of the blob  (EX: "2025-01-17/internal-review/summaries.parquet")
+    blob_service_client: BlobServiceClient
+        BlobServiceClient object
+
+    Returns
+    -------
+    bytes
+        Contents of the blob
+    """
+    input_container: ContainerClient = _container(blob_service_client, container_name)
+    blob_client: BlobClient = input_container.get_blob_client(blob_file_path)
+    # Download the blob in parallel ranges
+    download_stream: StorageStreamDownloader[bytes] = blob_client.download_blob(
+        max_concurrency=8
+    )
+    # Read all bytes of the blob into memory, saving time writing/reading from the file
+    # system. Polars reads the bytes directly, so don't copy them into a BytesIO.
+    return download_stream.readall()
+
+
+def scan_parquet_bytes(
+    blob_bytes: bytes,
+    columns: tuple[str, ...] | None = None,
+) -> pl.LazyFrame:
+    """
+    Lazily scan an in-memory parquet file, so that filters and column selections
+    downstream are pushed into the parquet reader. For NSSP API v1, we used
+    categories/dictionaries/factors when saving the parquet. These are left as they
+    are: only the join keys are cast to strings, after filtering, in
+    gold_data_formatting() and read_and_process_summary_data().
+
+    Parameters
+    ----------
+    blob_bytes: bytes
+        parquet file contents, e.g. from read_blob_bytes()
+    columns: tuple[str, ...], optional
+        only read these columns. If None, read all of them
+
+    Returns
+    -------
+    pl.LazyFrame
+        Scan of the parquet file
+    """
+    lf = pl.scan_parquet(blob_bytes, use_statistics=True)
+    if columns is not None:
+        lf = lf.select(columns)
+    return lf
+
+
+def read_blob_file(
+    container_name: str,
+    blob_file_path: str,
+    blob_service_client: BlobServiceClient,
+    columns: tuple[str, ...] | None = None,
 ) -> pl.DataFrame:
     """
     Reads a single parquet file from blob into memory
@@ -24,38 +155,32 @@ def read_blob_file(
         name of the blob  (EX: "2025-01-17/internal-review/summaries.parquet")
     blob_service_client: BlobServiceClient
         BlobServiceClient object
+    columns: tuple[str, ...], optional
+        only read these columns (EX: SUMMARY_COLUMNS). If None, read all of them
 
     Returns
     -------
     pl.DataFrame
         File read from blob
     """
-    input_container: ContainerClient = blob_service_client.get_container_client(
-        container_name
+    blob_bytes = read_blob_bytes(
+        container_name=container_name,
+        blob_file_path=blob_file_path,
+        blob_service_client=blob_service_client,
     )
-    blob_client: BlobClient = input_container.get_blob_client(blob_file_path)
-    download_stream: StorageStreamDownloader[bytes] = blob_client.download_blob()
-    # Read all bytes of the blob into an IO stream, saving time writing/reading from
-    # the file system
-    bytes_io = BytesIO(download_stream.readall())
-
-    # For NSSP API v1, we used categories/dictionaries/factors when saving the parquet.
-    # This turned out to be a poor choice. Convert from cateogires to str here for
-    # easier dataframe joining later.
-    df = pl.read_parquet(bytes_io).with_columns(pl.col(pl.Categorical).cast(pl.String))
-    return df
+    return scan_parquet_bytes(blob_bytes, columns=columns).collect()
 
 
 def gold_data_formatting(
-    gold_df: pl.DataFrame, value_name: str, date_cut_off: date
-) -> pl.DataFrame:
+    gold_df: pl.LazyFrame, value_name: str, date_cut_off: date
+) -> pl.LazyFrame:
     """
     Function to format a nssp gold dataset (rename columns, select diseases, etc)
 
     Parameters
     ----------
-    gold_df : pl.DataFrame
-        gold data as polars dataframe
+    gold_df : pl.LazyFrame
+        gold data as polars lazyframe
     value_name: str
         what to rename the value column to (EX: "raw_data versus" "raw_data_prev_wk")
     date_cut_off: date
@@ -63,25 +188,21 @@ def gold_data_formatting(
 
     Returns
     -------
-    pl.DataFrame
+    pl.LazyFrame
         processed gold data
     """
-    nssp_gold = (
-        gold_df.filter(pl.col("metric") == "count_ed_visits")
-        .with_columns(
-            [
-                (
-                    pl.when(pl.col("disease") == "COVID-19/Omicron")
-                    .then(pl.lit("COVID-19"))
-                    .otherwise(pl.col("disease"))
-                ).name.keep()
-            ]
-        )
-        .filter(
-            # Filter based on pathogen_to_run
-            pl.col("disease").is_in(("COVID-19", "Influenza")),
-            pl.col("reference_date") >= date_cut_off,
-        )
+    nssp_gold = gold_df.filter(
+        pl.col("metric") == "count_ed_visits",
+        # Filter based on pathogen_to_run. Do this before renaming, so the rename only
+        # touches the rows we keep
+        pl.col("disease").is_in(("COVID-19", "COVID-19/Omicron", "Influenza")),
+        pl.col("reference_date") >= date_cut_off,
+    ).with_columns(
+        # The gold files may store these as categoricals with their own encoding. Cast
+        # them to strings only now, after filtering, so the filters above reach the
+        # parquet reader and rows they exclude are never cast
+        pl.col("geo_value").cast(pl.String),
+        pl.col("disease").cast(pl.String).replace({"COVID-19/Omicron": "COVID-19"}),
     )
     # Summarize health data by reference_date, geo_value, and disease
     healthdata_df_agg = (
@@ -93,40 +214,52 @@ def gold_data_formatting(
 
 
 def combine_gold_current_and_prev(
-    date_to_use: date,
+    dates: DateContext,
     blob_service_client: BlobServiceClient,
     container_name: str = "nssp-etl",
-) -> pl.DataFrame:
+) -> pl.LazyFrame:
     """
-    Read in current and previous gold files with read_blob_file(). Format each
+    Read in current and previous gold files with read_blob_bytes(). Format each
     with gold_data_formatting(). Merge them together, create an aggregate US version.
-    Merge back together
+    Merge back together. The whole pipeline is lazy, so the filters are pushed into the
+    parquet reads, and it is collected along with the summary data in
+    prepare_plot_data().
 
     Parameters
     ----------
+    dates: DateContext
+        report date, the date a week before it, and the plotting cut off date
     blob_service_client: BlobServiceClient
         BlobServiceClient object
-    date_to_use: date
-        report date
 
     Returns
     -------
-    pl.DataFrame
-        merged gold data (current date and week prior)
+    pl.LazyFrame
+        merged gold data (current date and week prior), with geo_value and disease
+        as strings
     """
-    past_week = date_to_use - timedelta(days=7)
-    date_cut_off = date_to_use - timedelta(weeks=8)
-    # read the gold files (same date as summaries.parquet and week prior)
-    nssp_gold = read_blob_file(
-        blob_service_client=blob_service_client,
-        container_name=container_name,
-        blob_file_path="gold/" + date_to_use.isoformat() + ".parquet",
-    )
-    nssp_gold_previous_wk = read_blob_file(
-        blob_service_client=blob_service_client,
-        container_name=container_name,
-        blob_file_path="gold/" + past_week.isoformat() + ".parquet",
-    )
+    date_to_use = dates.end_date
+    past_week = dates.past_week
+    date_cut_off = dates.date_cut_off
+    # read the gold files (same date as summaries.parquet and week prior). These are
+    # independent network reads, so download them at the same time.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        nssp_gold_future = executor.submit(
+            read_blob_bytes,
+            blob_service_client=blob_service_client,
+            container_name=container_name,
+            blob_file_path=f"gold/{date_to_use.isoformat()}.parquet",
+        )
+        nssp_gold_previous_wk_future = executor.submit(
+            read_blob_bytes,
+            blob_service_client=blob_service_client,
+            container_name=container_name,
+            blob_file_path=f"gold/{past_week.isoformat()}.parquet",
+        )
+        nssp_gold = scan_parquet_bytes(nssp_gold_future.result(), columns=GOLD_COLUMNS)
+        nssp_gold_previous_wk = scan_parquet_bytes(
+            nssp_gold_previous_wk_future.result(), columns=GOLD_COLUMNS
+        )
     healthdata_df_agg = gold_data_formatting(
         gold_df=nssp_gold, value_name="raw_obs_data", date_cut_off=date_cut_off
     )
@@ -144,20 +277,31 @@ def combine_gold_current_and_prev(
         on=["reference_date", "geo_value", "disease"],
         how="left",
     )
-    # Create US data by summarizing across all states and then adding 'US' as a state
+    # Create US data by summarizing across all states and then adding 'US' as a state.
+    # This is part of the same lazy plan as the state rows, so polars computes the
+    # state join once and feeds it to both branches.
     us_df_agg = (
         healthdata_df_agg_join.filter(
             pl.col("geo_value") != "US"
         )  # Exclude existing 'US' rows if any
-        .with_columns(pl.lit("US").alias("geo_value"))
-        .group_by(["reference_date", "geo_value", "disease"])
+        .group_by(["reference_date", "disease"])
         .agg(
-            pl.col("raw_obs_data").sum().alias("raw_obs_data"),
-            pl.col("raw_obs_data_prev_wk").sum().alias("raw_obs_data_prev_wk"),
+            pl.col("raw_obs_data").sum(),
+            pl.col("raw_obs_data_prev_wk").sum(),
+        )
+        .select(
+            "reference_date",
+            pl.lit("US").alias("geo_value"),
+            "disease",
+            "raw_obs_data",
+            "raw_obs_data_prev_wk",
         )
     )
-    # Combine health data with US data
-    healthdata_df_combined = pl.concat([healthdata_df_agg_join, us_df_agg])
+    # Combine health data with US data. Don't rechunk, which would copy everything into
+    # one contiguous buffer; the joins downstream are fine with multiple chunks.
+    healthdata_df_combined = pl.concat(
+        [healthdata_df_agg_join, us_df_agg], how="vertical", rechunk=False
+    )
     return healthdata_df_combined
 
 
@@ -168,9 +312,13 @@ def read_and_process_summary_data(
         "expected_nowcast_cases",
         "expected_obs_cases",
     ),
-) -> pl.DataFrame:
+    disease: str | None = None,
+    state: str | None = None,
+) -> pl.LazyFrame:
     """
-    Read summaries.parquet with read_blob_file() and then reformat and pivot the data
+    Read summaries.parquet with read_blob_file() and then reformat and pivot the data.
+    The pivot is lazy, so that it is collected once along with both plotting datasets
+    in prepare_plot_data().
 
     Parameters
     ----------
@@ -178,53 +326,94 @@ def read_and_process_summary_data(
         The summary DataFrame
     variable_values: tuple
         list of the _variable values to pivot over into columns
+    disease: str, optional
+        If given, only pivot the rows for this disease (EX: "Influenza")
+    state: str, optional
+        If given, only pivot the rows for this geo_value (EX: "US")
 
     Returns
     -------
-    pl.DataFrame
-        processed and pivoted summaries data
+    pl.LazyFrame
+        processed and pivoted summaries data, with geo_value and disease as strings
     """
+    # Filter down to the rows we need before pivoting, as the pivot is the expensive
+    # step
+    predicates = [pl.col("_variable").is_in(variable_values)]
+    if disease is not None:
+        predicates.append(pl.col("disease") == disease)
+    if state is not None:
+        predicates.append(pl.col("geo_value") == state)
+
+    # Pivot each variable into its own columns with a conditional aggregation, rather
+    # than a `pivot`. This lets us name the columns directly, and skip the interval of
+    # the processed observations, which we don't use
+    pivot_aggs: list[pl.Expr] = []
+    for variable in variable_values:
+        is_variable = pl.col("_variable") == variable
+        pivot_aggs.append(pl.col("value").filter(is_variable).first().alias(variable))
+        if variable != "processed_obs_data":
+            pivot_aggs.extend(
+                pl.col(bound).filter(is_variable).first().alias(f"{bound}_{variable}")
+                for bound in ("_lower", "_upper")
+            )
+
     summary_pivot = (
-        summary_df.filter(pl.col("_variable").is_in(variable_values))
-        .pivot(
-            on="_variable",
-            values=["value", "_lower", "_upper"],
-            index=["time", "reference_date", "geo_value", "disease", "_width"],
+        summary_df.lazy()
+        .filter(*predicates)
+        .with_columns(
+            pl.col("geo_value").cast(pl.String),
+            pl.col("disease").cast(pl.String),
         )
-        .drop(["_upper_processed_obs_data", "_lower_processed_obs_data"])
-        .rename(
-            {
-                "value_processed_obs_data": "processed_obs_data",
-                "value_expected_obs_cases": "expected_obs_cases",
-                "value_expected_nowcast_cases": "expected_nowcast_cases",
-            }
+        .group_by(
+            ["time", "reference_date", "geo_value", "disease", "_width"],
+            maintain_order=True,
         )
+        .agg(pivot_aggs)
         .sort(["disease", "geo_value", "reference_date"])
     )
     return summary_pivot
 
 
 def process_obs_plot_data(
-    merged_gold_dfs: pl.DataFrame, summary_df: pl.DataFrame
-) -> pl.DataFrame:
+    merged_gold_dfs: pl.LazyFrame, summary_df: pl.LazyFrame
+) -> pl.LazyFrame:
     """
-    Create observation dataframe using both gold and summary datasets
+    Create observation dataframe using both gold and summary datasets. The gold
+    pipeline, the summary aggregation, and the join stay lazy, to be collected with
+    the interval data in prepare_plot_data().
 
     Parameters
     ----------
-    merged_gold_dfs: pl.DataFrame
+    merged_gold_dfs: pl.LazyFrame
         merged gold data (today's + last week's)
-    summary_df: pl.DataFrame
+    summary_df: pl.LazyFrame
         reformatted summary data
 
     Returns
     -------
-    pl.DataFrame
-        observation data from both gold and summaries
+    pl.LazyFrame
+        observation data from both gold and summaries. geo_value and disease keep
+        the dtype of the inputs. If they are categorical, collect it inside the
+        `pl.StringCache()` that the inputs were built in.
     """
+    # The pivot keeps `_width` in its index, so each key has several rows: the
+    # processed observations sit on a row without a width, and the expected cases on
+    # the width rows (duplicated per width). Taking the max over each key collapses
+    # them into one row, so this can't be replaced with a `unique`. Only hand the
+    # aggregation the columns it needs.
     raw_processed_obs = merged_gold_dfs.join(
         (
-            summary_df.group_by(["time", "reference_date", "geo_value", "disease"]).agg(
+            summary_df.select(
+                "time",
+                "reference_date",
+                "geo_value",
+                "disease",
+                "processed_obs_data",
+                "expected_obs_cases",
+                "expected_nowcast_cases",
+            )
+            .group_by(["time", "reference_date", "geo_value", "disease"])
+            .agg(
                 [
                     pl.max("processed_obs_data"),
                     pl.max("expected_obs_cases"),
@@ -239,35 +428,47 @@ def process_obs_plot_data(
 
 
 def process_interval_plot_data(
-    raw_processed_obs: pl.DataFrame, summary_df: pl.DataFrame
-) -> pl.DataFrame:
+    raw_processed_obs: pl.LazyFrame, summary_df: pl.LazyFrame
+) -> pl.LazyFrame:
     """
     Create dataset with interval data using raw_processed_obs and summary_df
 
     Parameters
     ----------
-    raw_processed_obs: pl.DataFrame
+    raw_processed_obs: pl.LazyFrame
         processed observation data
-    summary_df: pl.DataFrame
+    summary_df: pl.LazyFrame
         reformatted summary data
 
     Returns
     -------
-    pl.DataFrame
-        interval dataframe
+    pl.LazyFrame
+        interval dataframe. As for process_obs_plot_data(), collect it inside the
+        inputs' `pl.StringCache()` if their keys are categorical.
     """
-    intervals_modeled_obs = summary_df.filter(
+    # Only the last observed date is needed from the observation data. Join it on as a
+    # one-row frame rather than collecting it, so that the observations are computed
+    # once, when both frames are collected together.
+    max_date = raw_processed_obs.select(
+        pl.col("reference_date").max().alias("_max_date")
+    )
+    intervals_modeled_obs = (
+        # Drop the unused columns first, so the filter carries fewer columns along
+        summary_df.drop(["expected_obs_cases", "expected_nowcast_cases"])
         # This filters to just the rows representing a width
-        pl.col("processed_obs_data").is_null(),
-        pl.col("reference_date").le(
-            raw_processed_obs.get_column("reference_date").max()
-        ),
-    ).drop(["processed_obs_data", "expected_obs_cases", "expected_nowcast_cases"])
+        .filter(pl.col("processed_obs_data").is_null())
+        .join(max_date, how="cross")
+        .filter(pl.col("reference_date").le(pl.col("_max_date")))
+        .drop(["processed_obs_data", "_max_date"])
+    )
     return intervals_modeled_obs
 
 
 def prepare_plot_data(
-    summary_data: pl.DataFrame, date_to_use: date, bsc: BlobServiceClient
+    summary_data: pl.DataFrame,
+    date_to_use: date,
+    bsc: BlobServiceClient,
+    disease: str | None = None,
 ) -> tuple[pl.DataFrame, pl.DataFrame]:
     """
     Plotting funtion that combines all previous functions to read and generate gold_combined data as well as summary_pivot data and then generate final plotting datasets
@@ -280,26 +481,51 @@ def prepare_plot_data(
         BlobServiceClient object
     date_to_use: date
         report date
+    disease: str, optional
+        If given, only prepare the summary data for this disease (EX: "Influenza")
 
     Returns
     -------
     pl.DataFrames
         two datasets: one for observation data and one for interval
     """
-    gold_combined = combine_gold_current_and_prev(date_to_use, blob_service_client=bsc)
-    summary_pivot = read_and_process_summary_data(summary_data)
-
-    obs_plot_data = process_obs_plot_data(
-        merged_gold_dfs=gold_combined, summary_df=summary_pivot
-    )
-    interval_plot_data = process_interval_plot_data(
-        raw_processed_obs=obs_plot_data, summary_df=summary_pivot
-    )
+    dates = DateContext.from_date(date_to_use)
+    # Join the gold and summary frames on categorical keys. They need to share a
+    # string cache for their encodings to agree, so cast the keys inside one
+    with pl.StringCache():
+        gold_combined = combine_gold_current_and_prev(
+            dates, blob_service_client=bsc
+        ).with_columns(pl.col(JOIN_KEYS).cast(JOIN_KEY_DTYPE))
+        summary_pivot = read_and_process_summary_data(
+            summary_data, disease=disease
+        ).with_columns(pl.col(JOIN_KEYS).cast(JOIN_KEY_DTYPE))
+
+        obs_plot_lf = process_obs_plot_data(
+            merged_gold_dfs=gold_combined, summary_df=summary_pivot
+        )
+        interval_plot_lf = process_interval_plot_data(
+            raw_processed_obs=obs_plot_lf, summary_df=summary_pivot
+        )
+        # Collect both together, so polars runs the shared gold pipeline and summary
+        # pivot once
+        obs_plot_data, interval_plot_data = pl.collect_all(
+            [obs_plot_lf, interval_plot_lf]
+        )
     return obs_plot_data, interval_plot_data
 
 
 if __name__ == "__main__":
     # Some sample inputs for testing. Need to move something like this to an actual test
-    args = {"date_to_use": "2025-01-22"}
-    obs_plot_data = prepare_plot_data(date_to_use=args)[0]
-    interval_plot_data = prepare_plot_data(date_to_use=args)[1]
+    from src.cfa_rt_postprocessing.azure_constants import get_blob_service_client
+
+    date_to_use = date(2025, 1, 22)
+    bsc = get_blob_service_client()
+    summary_data = read_blob_file(
+        container_name="nssp-rt-post-process",
+        blob_file_path=f"{date_to_use.isoformat()}/internal-review/summaries.parquet",
+        blob_service_client=bsc,
+        columns=SUMMARY_COLUMNS,
+    )
+    obs_plot_data, interval_plot_data = prepare_plot_data(
+        summary_data=summary_data, date_to_use=date_to_use, bsc=bsc
+    )
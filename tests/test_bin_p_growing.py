@@ -0,0 +1,26 @@
+import polars as pl
+import pytest
+
+from src.cfa_rt_postprocessing.plotting.choropleth import bin_p_growing
+
+
+@pytest.mark.parametrize(
+    "p_growing, want_cat",
+    [
+        (0.0, "Declining"),
+        (0.10, "Declining"),
+        (0.11, "Likely Declining"),
+        (0.25, "Likely Declining"),
+        (0.5, "Not Changing"),
+        (0.75, "Not Changing"),
+        (0.9, "Likely Growing"),
+        (0.95, "Growing"),
+        (1.0, "Growing"),
+        (None, "Not Estimated"),
+    ],
+)
+def test_bin_p_growing(p_growing: float | None, want_cat: str):
+    df = pl.DataFrame(dict(p_growing=[p_growing]), schema={"p_growing": pl.Float64})
+    got, cats = bin_p_growing(df)
+    assert got.get_column("cat").to_list() == [want_cat]
+    assert got.get_column("hex").to_list() == [cats[want_cat]]
@@ -0,0 +1,36 @@
+from datetime import date
+from pathlib import Path
+
+import polars as pl
+import polars.testing
+
+from src.cfa_rt_postprocessing.main_functions import calculate_categories
+
+
+def test_calculate_categories(tmp_path: Path):
+    # Ten Rt samples per state, of which NY has 1 growing, CA 5, and TX 10. The other
+    # variables are ignored.
+    samples = pl.DataFrame(
+        dict(
+            geo_value=["NY"] * 10 + ["CA"] * 10 + ["TX"] * 10 + ["NY"] * 10,
+            disease="COVID-19",
+            reference_date=date(2025, 1, 1),
+            _variable=["Rt"] * 30 + ["growth_rate"] * 10,
+            value=[1.5] + [0.5] * 9 + [1.5] * 5 + [0.5] * 5 + [1.5] * 10 + [2.0] * 10,
+        )
+    )
+    samples_file = tmp_path / "samples.parquet"
+    samples.write_parquet(samples_file)
+
+    got = calculate_categories(samples_file)
+
+    want = pl.DataFrame(
+        dict(
+            geo_value=["CA", "NY", "TX"],
+            disease="COVID-19",
+            reference_date=date(2025, 1, 1),
+            p_growing=[0.5, 0.1, 1.0],
+            five_cat_p_growing=["Not Changing", "Declining", "Growing"],
+        )
+    )
+    polars.testing.assert_frame_equal(got, want)
@@ -0,0 +1,80 @@
+from datetime import date
+from io import BytesIO
+
+import polars as pl
+
+from src.cfa_rt_postprocessing.timeseries_data_formatting import (
+    DateContext,
+    combine_gold_current_and_prev,
+)
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readall(self) -> bytes:
+        return self.data
+
+
+class FakeBlobClient:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def download_blob(self, **kwargs) -> FakeDownload:
+        return FakeDownload(self.data)
+
+
+class FakeContainer:
+    def __init__(self, blobs: dict[str, bytes]):
+        self.blobs = blobs
+
+    def get_blob_client(self, name: str) -> FakeBlobClient:
+        return FakeBlobClient(self.blobs[name])
+
+
+class FakeBlobServiceClient:
+    def __init__(self, blobs: dict[str, bytes]):
+        self.container = FakeContainer(blobs)
+
+    def get_container_client(self, name: str) -> FakeContainer:
+        return self.container
+
+
+def gold_parquet(reference_dates: list[date], geo_values: list[str]) -> bytes:
+    buffer = BytesIO()
+    pl.DataFrame(
+        dict(
+            metric="count_ed_visits",
+            disease="COVID-19",
+            reference_date=reference_dates,
+            geo_value=geo_values,
+            value=[10] * len(reference_dates),
+        )
+    ).write_parquet(buffer)
+    return buffer.getvalue()
+
+
+def test_us_prev_wk_is_zero_without_prev_wk_data():
+    # The previous week's file has no rows for the current file's dates, so no state
+    # has previous week data to join
+    bsc = FakeBlobServiceClient(
+        {
+            "gold/2025-01-22.parquet": gold_parquet(
+                [date(2025, 1, 20)] * 2, ["NY", "CA"]
+            ),
+            "gold/2025-01-15.parquet": gold_parquet([date(2025, 1, 10)], ["NY"]),
+        }
+    )
+
+    # The keys are strings, so this collects without a string cache
+    got = (
+        combine_gold_current_and_prev(
+            DateContext.from_date(date(2025, 1, 22)), blob_service_client=bsc
+        )
+        .filter(pl.col("geo_value") == "US")
+        .collect()
+    )
+
+    assert got.get_column("raw_obs_data").to_list() == [20]
+    assert got.get_column("raw_obs_data_prev_wk").to_list() == [0]
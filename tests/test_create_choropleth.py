@@ -0,0 +1,21 @@
+import altair as alt
+import polars as pl
+import pytest
+
+from src.cfa_rt_postprocessing.plotting.choropleth import create_choropleth
+
+P_GROWING = pl.DataFrame(dict(id=[1, 2], state=["AL", "AK"], p_growing=[0.05, 0.95]))
+
+
+@pytest.mark.parametrize(
+    "states",
+    [
+        alt.topo_feature("https://example.com/us-10m.json", "states"),
+        # Sources without a TopoJSON URL fall back to altair's fluent API
+        alt.UrlData(url="https://example.com/states.json"),
+        alt.Data(values=[{"id": 1}, {"id": 2}]),
+    ],
+)
+def test_create_choropleth(states: alt.ChartDataType):
+    chart = create_choropleth(P_GROWING, states)
+    assert chart.to_dict()["data"] == states.to_dict()
@@ -0,0 +1,43 @@
+from pathlib import Path
+from typing import BinaryIO
+
+import pytest
+
+from src.cfa_rt_postprocessing.main_functions import download_blobs
+
+
+class FakeDownloader:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readinto(self, stream: BinaryIO) -> int:
+        return stream.write(self.data)
+
+
+class FakeContainerClient:
+    def __init__(self, blobs: dict[str, bytes]):
+        self.blobs = blobs
+
+    def download_blob(self, blob: str) -> FakeDownloader:
+        return FakeDownloader(self.blobs[blob])
+
+
+def test_download_blobs(tmp_path: Path):
+    blobs = {
+        f"job_{j}/summaries/task_{t}.parquet": f"{j}-{t}".encode()
+        for j in range(3)
+        for t in range(5)
+    }
+    names = list(blobs)
+
+    got = download_blobs(FakeContainerClient(blobs), names, local_root=tmp_path)
+
+    # The local paths come back in the same order as the blob names
+    assert got == [tmp_path / name for name in names]
+    for name, local_file in zip(names, got):
+        assert local_file.read_bytes() == blobs[name]
+
+
+def test_download_blobs_raises(tmp_path: Path):
+    with pytest.raises(KeyError):
+        download_blobs(FakeContainerClient({}), ["missing"], local_root=tmp_path)
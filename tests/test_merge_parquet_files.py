@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import duckdb
+import polars as pl
+import polars.testing
+
+from src.cfa_rt_postprocessing.main_functions import merge_parquet_files
+
+
+def test_merge_parquet_files(tmp_path: Path):
+    parts = {
+        "b.parquet": pl.DataFrame(dict(geo_value=["NY", "NY"], value=[3.0, 4.0])),
+        "a.parquet": pl.DataFrame(dict(geo_value=["CA", "CA"], value=[1.0, 2.0])),
+    }
+    for name, df in parts.items():
+        df.write_parquet(tmp_path / name)
+    output_file = tmp_path / "merged.parquet"
+
+    with duckdb.connect() as conn:
+        merge_parquet_files(conn, [tmp_path / name for name in parts], output_file)
+
+    # The files are merged in the order given
+    polars.testing.assert_frame_equal(
+        pl.read_parquet(output_file),
+        pl.concat([parts["b.parquet"], parts["a.parquet"]]),
+    )
@@ -0,0 +1,54 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import duckdb
+import polars as pl
+
+from src.cfa_rt_postprocessing.main_functions import read_task_metadata
+
+
+def test_read_task_metadata(tmp_path: Path):
+    # (task_id, geo_value, run_at)
+    tasks = [
+        # NY ran three times: keep the latest run inside the window
+        ("t1", "NY", "2025-01-20T10:00:00+00:00"),
+        ("t2", "NY", "2025-01-20T12:00:00+00:00"),
+        ("t3", "NY", "2025-01-20T16:00:00+00:00"),
+        # Exactly at the bounds of the window, one given in another time zone
+        ("t4", "CA", "2025-01-20T03:00:00-05:00"),
+        ("t5", "TX", "2025-01-20T14:00:00+00:00"),
+        # After the window
+        ("t6", "WA", "2025-01-20T15:00:00+00:00"),
+    ]
+    for task_id, geo_value, run_at in tasks:
+        md_file = tmp_path / f"job_{task_id}" / "metadata.json"
+        md_file.parent.mkdir()
+        md_file.write_text(
+            json.dumps(
+                dict(
+                    job_id=f"job_{task_id}",
+                    task_id=task_id,
+                    disease="COVID-19",
+                    geo_value=geo_value,
+                    production_date="2025-01-20",
+                    run_at=run_at,
+                )
+            )
+        )
+
+    with duckdb.connect() as conn:
+        got = read_task_metadata(
+            conn,
+            str(tmp_path / "**/metadata.json"),
+            min_runat=datetime(2025, 1, 20, 8, tzinfo=timezone.utc),
+            max_runat=datetime(2025, 1, 20, 14, tzinfo=timezone.utc),
+        ).sort("geo_value")
+
+    assert got.schema["run_at"] == pl.Datetime("us", "UTC")
+    assert got.get_column("task_id").to_list() == ["t4", "t2", "t5"]
+    assert got.get_column("run_at").to_list() == [
+        datetime(2025, 1, 20, 8, tzinfo=timezone.utc),
+        datetime(2025, 1, 20, 12, tzinfo=timezone.utc),
+        datetime(2025, 1, 20, 14, tzinfo=timezone.utc),
+    ]
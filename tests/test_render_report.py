@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+
+from src.cfa_rt_postprocessing import main_functions
+from src.cfa_rt_postprocessing.main_functions import render_report
+
+
+def test_render_report(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    package = tmp_path / "package"
+    package.mkdir()
+    unrendered = package / "anomaly_report.qmd"
+    unrendered.write_text("report")
+
+    rendered_from: list[Path] = []
+
+    def fake_render(input: Path, execute_params: dict, execute_dir: str):
+        # Render next to the input, as quarto does
+        rendered_from.append(input.parent)
+        assert execute_dir == str(package)
+        input.with_suffix(".html").write_text(execute_params["disease"])
+
+    monkeypatch.setattr(main_functions.quarto, "render", fake_render)
+
+    output = tmp_path / "covid_anomaly_report.html"
+    render_report(
+        disease="COVID-19",
+        desired_output_location=output,
+        summary_loc=tmp_path / "summaries.parquet",
+        samples_loc=tmp_path / "samples.parquet",
+        metadata_file=tmp_path / "metadata.parquet",
+        unrendered_location=unrendered,
+    )
+
+    assert output.read_text() == "COVID-19"
+    # The report was rendered outside the package, and nothing was left behind
+    assert rendered_from[0] != package
+    assert not rendered_from[0].exists()
+    assert list(package.iterdir()) == [unrendered]
+
+
+def test_render_report_failed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    unrendered = tmp_path / "anomaly_report.qmd"
+    unrendered.write_text("report")
+
+    # quarto.render() returns without writing the report when the render fails
+    monkeypatch.setattr(main_functions.quarto, "render", lambda **kwargs: None)
+
+    with pytest.raises(RuntimeError, match="Influenza"):
+        render_report(
+            disease="Influenza",
+            desired_output_location=tmp_path / "flu_anomaly_report.html",
+            summary_loc=tmp_path / "summaries.parquet",
+            samples_loc=tmp_path / "samples.parquet",
+            metadata_file=tmp_path / "metadata.parquet",
+            unrendered_location=unrendered,
+        )
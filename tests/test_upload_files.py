@@ -0,0 +1,42 @@
+from pathlib import Path
+from typing import BinaryIO
+
+from src.cfa_rt_postprocessing.main_functions import upload_files
+
+
+class FakeContainerClient:
+    url = "https://example.blob.core.windows.net/container"
+
+    def __init__(self, existing: set[str]):
+        self.blobs: dict[str, bytes] = {name: b"" for name in existing}
+
+    def upload_blob(
+        self, name: str, data: BinaryIO, overwrite: bool = False, **kwargs
+    ) -> None:
+        if name in self.blobs and not overwrite:
+            raise FileExistsError(name)
+        self.blobs[name] = data.read()
+
+
+def test_upload_files(tmp_path: Path):
+    local_files = []
+    for i in range(5):
+        local_file = tmp_path / f"file_{i}.csv"
+        local_file.write_bytes(f"file {i}".encode())
+        local_files.append(local_file)
+    # Upload the first file to a second name too
+    uploads = [(lf, f"blobs/{lf.name}") for lf in local_files]
+    uploads.append((local_files[0], "latest.csv"))
+    container_client = FakeContainerClient(existing={"blobs/file_3.csv"})
+
+    # The upload of the existing blob fails, but doesn't stop the others
+    upload_files(container_client, uploads, overwrite=False)
+
+    assert container_client.blobs == {
+        "blobs/file_0.csv": b"file 0",
+        "blobs/file_1.csv": b"file 1",
+        "blobs/file_2.csv": b"file 2",
+        "blobs/file_3.csv": b"",
+        "blobs/file_4.csv": b"file 4",
+        "latest.csv": b"file 0",
+    }